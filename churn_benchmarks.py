@@ -0,0 +1,312 @@
+"""
+Benchmarks for churn_library on synthetic data
+
+author: Mohammad Khan
+Date: 19 October, 2026
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+import churn_library as cls
+import churn_scoring as scoring
+
+# synthetic data sizes to benchmark
+BENCHMARK_ROWS = [10_000, 100_000, 1_000_000, 10_000_000]
+
+
+def make_synthetic_data(n_rows, random_state=42):
+    '''
+    returns synthetic feature engineered data shaped like perform_feature_engineering
+    output, churn is drawn from a logistic model of the transaction features
+
+    input:
+        n_rows: number of rows to generate
+        random_state: seed of the random generator
+    output:
+        data_X: pandas dataframe with cls.FEATURE_COLUMNS
+        data_y: pandas series of churn values
+    '''
+    rng = np.random.RandomState(random_state)
+
+    credit_limit = rng.lognormal(8.6, 0.8, n_rows).clip(1438.3, 34516.0)
+    revolving_bal = rng.uniform(0, 2517, n_rows).round()
+    trans_ct = rng.normal(65, 23, n_rows).clip(10, 139).round()
+
+    data_X = pd.DataFrame({
+        'Customer_Age': rng.normal(46, 8, n_rows).clip(26, 73).round(),
+        'Dependent_count': rng.randint(0, 6, n_rows),
+        'Months_on_book': rng.normal(36, 8, n_rows).clip(13, 56).round(),
+        'Total_Relationship_Count': rng.randint(1, 7, n_rows),
+        'Months_Inactive_12_mon': rng.randint(0, 7, n_rows),
+        'Contacts_Count_12_mon': rng.randint(0, 7, n_rows),
+        'Credit_Limit': credit_limit,
+        'Total_Revolving_Bal': revolving_bal,
+        'Avg_Open_To_Buy': (credit_limit - revolving_bal).clip(0),
+        'Total_Amt_Chng_Q4_Q1': rng.gamma(9, 0.085, n_rows),
+        'Total_Trans_Amt': trans_ct * rng.lognormal(3.9, 0.4, n_rows),
+        'Total_Trans_Ct': trans_ct,
+        'Total_Ct_Chng_Q4_Q1': rng.gamma(9, 0.079, n_rows),
+        'Avg_Utilization_Ratio': revolving_bal / credit_limit,
+        'Gender_Churn': rng.choice([0.146, 0.174], n_rows),
+        'Education_Level_Churn': rng.choice(
+            [0.152, 0.155, 0.159, 0.168, 0.173, 0.178, 0.211], n_rows),
+        'Marital_Status_Churn': rng.choice(
+            [0.151, 0.162, 0.168, 0.172], n_rows),
+        'Income_Category_Churn': rng.choice(
+            [0.134, 0.148, 0.151, 0.168, 0.172, 0.173], n_rows),
+        'Card_Category_Churn': rng.choice(
+            [0.148, 0.161, 0.176, 0.225], n_rows, p=[0.06, 0.01, 0.9, 0.03]),
+    })[cls.FEATURE_COLUMNS]
+
+    logit = (4.0
+             - 0.07 * data_X['Total_Trans_Ct']
+             - 0.0012 * data_X['Total_Revolving_Bal']
+             - 0.4 * data_X['Total_Relationship_Count']
+             + 0.45 * data_X['Months_Inactive_12_mon']
+             + 0.4 * data_X['Contacts_Count_12_mon']
+             - 1.5 * data_X['Total_Ct_Chng_Q4_Q1']
+             + 0.0003 * data_X['Total_Trans_Amt'])
+    data_y = pd.Series(
+        (rng.uniform(size=n_rows) < 1 / (1 + np.exp(-logit))).astype(int),
+        name='Churn')
+
+    return data_X, data_y
+
+
+def train_test_slices(data_X, data_y, test_size=0.3):
+    '''
+    splits synthetic data without copying, rows are already in random order
+
+    input:
+        data_X: pandas dataframe of X values
+        data_y: pandas series of y values
+        test_size: fraction of rows used for testing
+    output:
+        X_train, X_test, y_train, y_test
+    '''
+    n_train = int(len(data_X) * (1 - test_size))
+    return (data_X.iloc[:n_train], data_X.iloc[n_train:],
+            data_y.iloc[:n_train], data_y.iloc[n_train:])
+
+
+def benchmark_model_engines(row_counts=None, engines=None):
+    '''
+    benchmarks fit time, predict throughput and test AUC of model engines using their
+    untuned default estimators
+
+    input:
+        row_counts: list of synthetic data sizes, BENCHMARK_ROWS if None
+        engines: list of cls.MODEL_ENGINES keys, cls.DEFAULT_ENGINES if None
+    output:
+        results: pandas dataframe with one row per size and engine
+    '''
+    if row_counts is None:
+        row_counts = BENCHMARK_ROWS
+    if engines is None:
+        engines = cls.DEFAULT_ENGINES
+
+    results = []
+    for n_rows in row_counts:
+        X_train, X_test, y_train, y_test = train_test_slices(
+            *make_synthetic_data(n_rows))
+
+        for engine in engines:
+            model = cls.MODEL_ENGINES[engine]['estimator']()
+
+            start = time.perf_counter()
+            model.fit(X_train, y_train)
+            fit_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            y_test_probs = model.predict_proba(X_test)[:, 1]
+            predict_seconds = time.perf_counter() - start
+
+            results.append({
+                'rows': n_rows,
+                'engine': engine,
+                'fit_seconds': fit_seconds,
+                'predict_rows_per_sec': len(X_test) / predict_seconds,
+                'test_auc': roc_auc_score(y_test, y_test_probs),
+            })
+            print(results[-1])
+
+    return pd.DataFrame(results)
+
+
+def benchmark_quantization(row_counts=None, engines=None, n_bins=256):
+    '''
+    benchmarks training time, X_train memory and test AUC of the float64 feature
+    matrix against the uint8 quantile binned matrix
+
+    input:
+        row_counts: list of synthetic data sizes, BENCHMARK_ROWS if None
+        engines: list of cls.MODEL_ENGINES keys, ['rf', 'hgb'] if None
+        n_bins: maximum number of quantile bins per feature
+    output:
+        results: pandas dataframe with one row per size, engine and matrix type
+    '''
+    if row_counts is None:
+        row_counts = BENCHMARK_ROWS
+    if engines is None:
+        engines = ['rf', 'hgb']
+
+    results = []
+    for n_rows in row_counts:
+        X_train, X_test, y_train, y_test = train_test_slices(
+            *make_synthetic_data(n_rows))
+
+        start = time.perf_counter()
+        bin_edges = cls.quantile_bin_edges(X_train, n_bins)
+        X_train_binned = cls.apply_bin_edges(X_train, bin_edges)
+        X_test_binned = cls.apply_bin_edges(X_test, bin_edges)
+        binning_seconds = time.perf_counter() - start
+
+        matrices = {
+            'float64': (X_train, X_test, 0.0),
+            'uint8': (X_train_binned, X_test_binned, binning_seconds),
+        }
+        for engine in engines:
+            for matrix, (x_train, x_test, prep_seconds) in matrices.items():
+                model = cls.MODEL_ENGINES[engine]['estimator']()
+
+                start = time.perf_counter()
+                model.fit(x_train, y_train)
+                fit_seconds = time.perf_counter() - start
+
+                results.append({
+                    'rows': n_rows,
+                    'engine': engine,
+                    'matrix': matrix,
+                    'x_train_mb': np.asarray(x_train).nbytes / 2 ** 20,
+                    'binning_seconds': prep_seconds,
+                    'fit_seconds': fit_seconds,
+                    'test_auc': roc_auc_score(
+                        y_test, model.predict_proba(x_test)[:, 1]),
+                })
+                print(results[-1])
+
+    return pd.DataFrame(results)
+
+
+def benchmark_logistic_solvers(row_counts=None):
+    '''
+    benchmarks iterations, fit time and test AUC of the logistic regression solvers
+    on raw and on standardized features
+
+    input:
+        row_counts: list of synthetic data sizes, BENCHMARK_ROWS if None
+    output:
+        results: pandas dataframe with one row per size, solver and scaling
+    '''
+    if row_counts is None:
+        row_counts = BENCHMARK_ROWS
+
+    results = []
+    for n_rows in row_counts:
+        splits = train_test_slices(*make_synthetic_data(n_rows))
+        for scaled in [False, True]:
+            solvers = cls.compare_logistic_solvers(*splits, scaled=scaled)
+            solvers.insert(0, 'rows', n_rows)
+            print(solvers.to_string(index=False, header=False))
+            results.append(solvers)
+
+    return pd.concat(results, ignore_index=True)
+
+
+def benchmark_explanations(row_counts=None, methods=None, n_jobs=-1):
+    '''
+    benchmarks rows/sec of the per customer churn drivers of a random forest
+
+    input:
+        row_counts: list of synthetic data sizes, BENCHMARK_ROWS if None
+        methods: list of churn_scoring.EXPLAIN_METHODS keys, all if None
+        n_jobs: number of worker processes
+    output:
+        results: pandas dataframe with one row per size and method
+    '''
+    if row_counts is None:
+        row_counts = BENCHMARK_ROWS
+    if methods is None:
+        methods = list(scoring.EXPLAIN_METHODS)
+
+    # the forest is trained once, only the explained rows grow
+    X_train, y_train = make_synthetic_data(10_000, random_state=0)
+    model = RandomForestClassifier(
+        n_estimators=200, max_depth=8, random_state=42).fit(X_train, y_train)
+
+    results = []
+    for n_rows in row_counts:
+        data_X, _ = make_synthetic_data(n_rows)
+        for method in methods:
+            start = time.perf_counter()
+            scoring.explain_customers(model, data_X, method, n_jobs=n_jobs)
+            results.append({
+                'rows': n_rows,
+                'method': method,
+                'rows_per_sec': n_rows / (time.perf_counter() - start),
+            })
+            print(results[-1])
+
+    return pd.DataFrame(results)
+
+
+def benchmark_hash_split(row_counts=None):
+    '''
+    benchmarks the vectorized hash split of customer ids against a random split
+
+    input:
+        row_counts: list of synthetic data sizes, BENCHMARK_ROWS if None
+    output:
+        results: pandas dataframe with one row per size
+    '''
+    if row_counts is None:
+        row_counts = BENCHMARK_ROWS
+
+    results = []
+    for n_rows in row_counts:
+        rng = np.random.RandomState(42)
+        client_ids = rng.randint(7e8, 8e8, n_rows)
+
+        start = time.perf_counter()
+        buckets = cls.hash_split(client_ids, test_size=0.3)
+        hash_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        train_test_split(client_ids, test_size=0.3, random_state=42)
+        random_seconds = time.perf_counter() - start
+
+        results.append({
+            'rows': n_rows,
+            'hash_seconds': hash_seconds,
+            'random_split_seconds': random_seconds,
+            'hash_rows_per_sec': n_rows / hash_seconds,
+            'test_fraction': np.mean(np.asarray(buckets == 'test')),
+        })
+        print(results[-1])
+
+    return pd.DataFrame(results)
+
+
+# benchmarks runnable from the command line
+BENCHMARKS = {
+    'engines': benchmark_model_engines,
+    'quantization': benchmark_quantization,
+    'logistic': benchmark_logistic_solvers,
+    'explanations': benchmark_explanations,
+    'split': benchmark_hash_split,
+}
+
+
+if __name__ == "__main__":
+    # benchmark name and optional row counts from the command line,
+    # e.g. python churn_benchmarks.py quantization 10000 100000
+    _name = sys.argv[1] if len(sys.argv) > 1 else 'engines'
+    _row_counts = [int(arg) for arg in sys.argv[2:]] or None
+
+    print('Benchmarking ' + _name)
+    print(BENCHMARKS[_name](_row_counts).to_string(index=False))
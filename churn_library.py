@@ -8,18 +8,27 @@ Date: 28 May, 2023
 # import libraries
 import os
 import sys
+import time
 import seaborn as sns
-from sklearn.metrics import plot_roc_curve, classification_report
+from sklearn.metrics import roc_auc_score
 from sklearn.model_selection import GridSearchCV
 from sklearn.ensemble import RandomForestClassifier
+# HistGradientBoostingClassifier is still experimental in scikit-learn 0.24
+from sklearn.experimental import enable_hist_gradient_boosting  # noqa: F401
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.ensemble import ExtraTreesClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
 # from sklearn.preprocessing import normalize
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import joblib
-import shap
+from joblib import Parallel, delayed
+import numba
+import churn_rendering as rendering
 
 os.environ['QT_QPA_PLATFORM'] = 'offscreen'
 sns.set()
@@ -30,6 +39,99 @@ RESULTS_IMAGE_SAVE_FOLDER = 'images/results/'
 DATA_PTH = 'data/bank_data.csv'
 MODELS_SAVE_FOLDER = 'models/'
 
+# features used for training, in model column order
+FEATURE_COLUMNS = [
+    'Customer_Age',
+    'Dependent_count',
+    'Months_on_book',
+    'Total_Relationship_Count',
+    'Months_Inactive_12_mon',
+    'Contacts_Count_12_mon',
+    'Credit_Limit',
+    'Total_Revolving_Bal',
+    'Avg_Open_To_Buy',
+    'Total_Amt_Chng_Q4_Q1',
+    'Total_Trans_Amt',
+    'Total_Trans_Ct',
+    'Total_Ct_Chng_Q4_Q1',
+    'Avg_Utilization_Ratio',
+    'Gender_Churn',
+    'Education_Level_Churn',
+    'Marital_Status_Churn',
+    'Income_Category_Churn',
+    'Card_Category_Churn']
+
+# registered model engines. Every engine is trained, tuned (when it has a
+# param_grid), saved and evaluated the same way by train_models.
+MODEL_ENGINES = {
+    'rf': {
+        'name': 'Random Forest',
+        'estimator': lambda: RandomForestClassifier(random_state=42),
+        'param_grid': {
+            'n_estimators': [200, 500],
+            'max_features': ['auto', 'sqrt'],
+            'max_depth': [4, 5, 100],
+            'criterion': ['gini', 'entropy']
+        },
+        'model_file': 'rfc_model.pkl',
+        'report_file': 'rf_results.png',
+    },
+    'lr': {
+        'name': 'Logistic Regression',
+        # features are standardized so every solver converges in few iterations
+        # Reference:
+        # https://scikit-learn.org/stable/modules/linear_model.html#logistic-regression
+        'estimator': lambda: build_logistic_pipeline('lbfgs'),
+        'param_grid': {
+            'logistic__solver': ['lbfgs', 'saga', 'liblinear'],
+        },
+        'model_file': 'logistic_model.pkl',
+        'report_file': 'logistic_results.png',
+    },
+    'hgb': {
+        'name': 'Histogram Gradient Boosting',
+        'estimator': lambda: HistGradientBoostingClassifier(random_state=42),
+        'param_grid': {
+            'learning_rate': [0.05, 0.1],
+            'max_iter': [100, 300],
+            'max_leaf_nodes': [15, 31],
+        },
+        'model_file': 'hgb_model.pkl',
+        'report_file': 'hgb_results.png',
+    },
+    'et': {
+        'name': 'Extra Trees',
+        'estimator': lambda: ExtraTreesClassifier(random_state=42),
+        'param_grid': {
+            'n_estimators': [200, 500],
+            'max_depth': [5, 100],
+        },
+        'model_file': 'et_model.pkl',
+        'report_file': 'et_results.png',
+    },
+}
+
+# engines trained by default
+DEFAULT_ENGINES = ['rf', 'lr', 'hgb']
+
+# quantile bin edges learned by perform_feature_engineering(quantize=True)
+BIN_EDGES_FILE = 'bin_edges.pkl'
+# churn proportion of every category, saved by perform_feature_engineering
+CATEGORY_ENCODINGS_FILE = 'category_encodings.pkl'
+
+# per segment models saved by train_segment_models
+SEGMENT_MODELS_FILE = 'segment_models.pkl'
+# segments with fewer training rows fall back to the global model
+MIN_SEGMENT_SIZE = 300
+
+# compacted random forest saved by compact_saved_forest
+COMPACT_MODEL_FILE = 'rfc_compact_model.pkl'
+# depths tried when pruning the compacted forest
+COMPACT_DEPTHS = [4, 6, 8, 10, 12, 16, 20, 32]
+
+# buckets assigned by hash_split
+SPLIT_BUCKETS = ['train', 'test', 'validation']
+
 
 def import_data(pth):
     '''
@@ -137,18 +239,176 @@ def encoder_helper(df, category_lst, response='Churn'):
     return df
 
 
-def perform_feature_engineering(df, response='Churn'):
+def category_encodings(df, category_lst, response='Churn'):
+    '''
+    returns the churn proportion of every category, the mapping applied by
+    encoder_helper, so new data can be encoded at scoring time
+
+    input:
+        df: pandas dataframe
+        category_lst: list of columns that contain categorical features
+        response: string of response name
+
+    output:
+        encodings: dict of column -> pandas series of response mean per category
+    '''
+    return {
+        category: df.groupby(category)[response].mean()
+        for category in category_lst
+    }
+
+
+def _splitmix64(values):
+    '''
+    splitmix64 finalizer, a fast and well mixed uint64 -> uint64 hash
+    '''
+    with np.errstate(over='ignore'):
+        values = values + np.uint64(0x9E3779B97F4A7C15)
+        values = (values ^ (values >> np.uint64(30))) * \
+            np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * \
+            np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def hash_split(client_ids,
+               test_size=0.3,
+               validation_size=0.0,
+               salt=0):
+    '''
+    assigns every customer to a train, test or validation bucket by hashing its id.
+    The bucket of a customer only depends on its id, so the split can be computed
+    chunk by chunk and does not change when customers are added.
+
+    input:
+        client_ids: integer customer ids, e.g. the CLIENTNUM column
+        test_size: expected fraction of customers in the test bucket
+        validation_size: expected fraction of customers in the validation bucket
+        salt: integer changing the assignment of every customer
+
+    output:
+        buckets: pandas categorical of SPLIT_BUCKETS values
+    '''
+    if test_size + validation_size > 1:
+        raise ValueError('test_size + validation_size must be at most 1')
+
+    keys = np.asarray(client_ids).astype(np.int64).view(np.uint64) ^ \
+        _splitmix64(np.asarray([salt], dtype=np.uint64))
+
+    # top 53 bits of the hash as a uniform float in [0, 1)
+    uniform = (_splitmix64(keys) >> np.uint64(11)) * 2.0 ** -53
+
+    codes = np.zeros(len(uniform), dtype=np.int8)
+    codes[uniform < test_size + validation_size] = 2
+    codes[uniform < test_size] = 1
+    return pd.Categorical.from_codes(codes, SPLIT_BUCKETS)
+
+
+def hash_split_csv(pth,
+                   output_pth,
+                   chunksize=1_000_000,
+                   id_column='CLIENTNUM',
+                   **split_kwargs):
+    '''
+    splits the csv found at pth chunk by chunk into <bucket>.csv files in
+    output_pth without loading the whole file
+
+    input:
+        pth: a path to the csv
+        output_pth: folder of the train.csv, test.csv and validation.csv files
+        chunksize: number of rows read at a time
+        id_column: column of the customer ids
+        split_kwargs: test_size, validation_size and salt of hash_split
+
+    output:
+        counts: dict of bucket -> number of rows written
+    '''
+    os.makedirs(output_pth, exist_ok=True)
+    counts = dict.fromkeys(SPLIT_BUCKETS, 0)
+
+    for chunk in pd.read_csv(pth, chunksize=chunksize):
+        buckets = hash_split(chunk[id_column], **split_kwargs)
+
+        for bucket in SPLIT_BUCKETS:
+            rows = chunk[np.asarray(buckets == bucket)]
+            if len(rows) or not counts[bucket]:
+                # the first chunk writes the header, even for empty buckets
+                rows.to_csv(
+                    os.path.join(output_pth, bucket + '.csv'),
+                    mode='a' if counts[bucket] else 'w',
+                    header=not counts[bucket],
+                    index=False)
+            counts[bucket] += len(rows)
+
+    return counts
+
+
+def quantile_bin_edges(X_data, n_bins=256):
+    '''
+    learns per feature quantile bin edges
+
+    input:
+        X_data: pandas dataframe of X values
+        n_bins: maximum number of bins per feature, at most 256 to fit in uint8
+
+    output:
+        bin_edges: dict with the feature 'columns' and the sorted 'edges' of each feature
+    '''
+    if not 2 <= n_bins <= 256:
+        raise ValueError('n_bins must be between 2 and 256, got {}'.format(n_bins))
+
+    quantiles = np.linspace(0, 1, n_bins + 1)[1:-1]
+    # one pass over all columns, duplicated edges of discrete features are dropped
+    edges = np.quantile(np.asarray(X_data, dtype=np.float64), quantiles, axis=0)
+
+    return {
+        'columns': list(X_data.columns),
+        'edges': [np.unique(edges[:, i]) for i in range(edges.shape[1])],
+    }
+
+
+def apply_bin_edges(X_data, bin_edges):
+    '''
+    bins X_data with the learned quantile bin edges
+
+    input:
+        X_data: pandas dataframe of X values with the bin_edges columns
+        bin_edges: output of quantile_bin_edges
+
+    output:
+        X_binned: C-contiguous uint8 numpy array, bin index of every value
+    '''
+    values = X_data[bin_edges['columns']].to_numpy(dtype=np.float64)
+    X_binned = np.empty(values.shape, dtype=np.uint8, order='C')
+    for i, edges in enumerate(bin_edges['edges']):
+        # value v goes to bin k when edges[k - 1] <= v < edges[k]
+        X_binned[:, i] = np.searchsorted(edges, values[:, i], side='right')
+
+    return X_binned
+
+
+def perform_feature_engineering(df,
+                                response='Churn',
+                                quantize=False,
+                                n_bins=256,
+                                split='random'):
     '''
     input:
         df: pandas dataframe
         response: string of response name
             [optional argument that could be used for naming variables or index y column]
+        quantize: if True, X data is binned into uint8 quantiles learned on X_train and
+            the bin edges are saved in MODELS_SAVE_FOLDER for scoring
+        n_bins: maximum number of quantile bins per feature when quantize is True
+        split: 'random' for a seeded random split, or 'hash' for a hash_split of
+            CLIENTNUM, stable when customers are added or churn
 
     output:
         X_train: X training data
         X_test: X testing data
         y_train: y training data
         y_test: y testing data
+        the category encodings are saved in MODELS_SAVE_FOLDER for scoring
     '''
     # create y
     data_y = df[response]
@@ -186,40 +446,499 @@ def perform_feature_engineering(df, response='Churn'):
     cat_columns.remove('Attrition_Flag')
 
     df = encoder_helper(df, cat_columns, response=response)
+    joblib.dump(
+        category_encodings(df, cat_columns, response=response),
+        MODELS_SAVE_FOLDER + CATEGORY_ENCODINGS_FILE)
 
     data_X = pd.DataFrame()
-    keep_cols = [
-        'Customer_Age',
-        'Dependent_count',
-        'Months_on_book',
-        'Total_Relationship_Count',
-        'Months_Inactive_12_mon',
-        'Contacts_Count_12_mon',
-        'Credit_Limit',
-        'Total_Revolving_Bal',
-        'Avg_Open_To_Buy',
-        'Total_Amt_Chng_Q4_Q1',
-        'Total_Trans_Amt',
-        'Total_Trans_Ct',
-        'Total_Ct_Chng_Q4_Q1',
-        'Avg_Utilization_Ratio',
-        'Gender_Churn',
-        'Education_Level_Churn',
-        'Marital_Status_Churn',
-        'Income_Category_Churn',
-        'Card_Category_Churn']
-
-    data_X[keep_cols] = df[keep_cols]
+    data_X[FEATURE_COLUMNS] = df[FEATURE_COLUMNS]
 
     # This cell may take up to 15-20 minutes to run
     # train test split
-    X_train, X_test, y_train, y_test = train_test_split(
-        data_X, data_y, test_size=0.3, random_state=42
-    )
+    if split == 'hash':
+        is_test = np.asarray(
+            hash_split(df['CLIENTNUM'], test_size=0.3) == 'test')
+        X_train, X_test = data_X[~is_test], data_X[is_test]
+        y_train, y_test = data_y[~is_test], data_y[is_test]
+    else:
+        X_train, X_test, y_train, y_test = train_test_split(
+            data_X, data_y, test_size=0.3, random_state=42
+        )
+
+    if quantize:
+        # 8x smaller than float64 and at most n_bins split candidates per feature
+        bin_edges = quantile_bin_edges(X_train, n_bins)
+        joblib.dump(bin_edges, MODELS_SAVE_FOLDER + BIN_EDGES_FILE)
+        X_train = apply_bin_edges(X_train, bin_edges)
+        X_test = apply_bin_edges(X_test, bin_edges)
 
     return X_train, X_test, y_train, y_test
 
 
+def build_logistic_pipeline(solver='lbfgs', max_iter=3000):
+    '''
+    returns a logistic regression pipeline with a standardization stage, the scaler
+    is fitted on the training data and saved with the model
+
+    input:
+            solver: logistic regression solver, e.g. 'lbfgs', 'saga' or 'liblinear'
+            max_iter: maximum number of solver iterations
+
+    output:
+            pipeline: unfitted sklearn Pipeline of scaler and logistic steps
+    '''
+    return Pipeline([
+        ('scaler', StandardScaler()),
+        ('logistic', LogisticRegression(solver=solver, max_iter=max_iter)),
+    ])
+
+
+def compare_logistic_solvers(X_train,
+                             X_test,
+                             y_train,
+                             y_test,
+                             solvers=None,
+                             scaled=True):
+    '''
+    fits logistic regression with every solver and records its convergence
+    input:
+            X_train: X training data
+            X_test: X testing data
+            y_train: y training data
+            y_test: y testing data
+            solvers: list of solvers, the 'lr' engine param_grid solvers if None
+            scaled: if False, fits on the raw features without the scaler
+
+    output:
+            results: pandas dataframe of solver, iterations, fit time and test AUC
+    '''
+    if solvers is None:
+        solvers = MODEL_ENGINES['lr']['param_grid']['logistic__solver']
+
+    results = []
+    for solver in solvers:
+        pipeline = build_logistic_pipeline(solver)
+        logistic = pipeline.named_steps['logistic']
+        model = pipeline if scaled else logistic
+
+        start = time.perf_counter()
+        model.fit(X_train, y_train)
+        fit_seconds = time.perf_counter() - start
+
+        results.append({
+            'solver': solver,
+            'scaled': scaled,
+            'n_iter': int(np.max(logistic.n_iter_)),
+            'converged': int(np.max(logistic.n_iter_)) < logistic.max_iter,
+            'fit_seconds': fit_seconds,
+            'test_auc': roc_auc_score(y_test, model.predict_proba(X_test)[:, 1]),
+        })
+
+    return pd.DataFrame(results)
+
+
+def register_model_engine(key,
+                          name,
+                          estimator,
+                          model_file,
+                          report_file,
+                          param_grid=None):
+    '''
+    registers a model engine so train_models can train, tune, save and evaluate it
+    input:
+            key: short engine name used to select it in train_models
+            name: display name used in reports and ROC plot
+            estimator: callable returning a new unfitted sklearn classifier
+            model_file: file name of the saved model in MODELS_SAVE_FOLDER
+            report_file: file name of the report image in RESULTS_IMAGE_SAVE_FOLDER
+            param_grid: optional GridSearchCV parameter grid
+
+    output:
+             None
+    '''
+    MODEL_ENGINES[key] = {
+        'name': name,
+        'estimator': estimator,
+        'param_grid': param_grid,
+        'model_file': model_file,
+        'report_file': report_file,
+    }
+
+
+def fit_model_engine(engine, X_train, y_train, n_jobs=None):
+    '''
+    fits a registered model engine, tuned with a grid search if it has a param_grid
+    input:
+            engine: key of the engine in MODEL_ENGINES, or the engine spec itself
+            X_train: X training data
+            y_train: y training data
+            n_jobs: number of jobs for the grid search
+
+    output:
+            model: fitted estimator (best estimator of the grid search if tuned)
+    '''
+    spec = MODEL_ENGINES[engine] if isinstance(engine, str) else engine
+    model = spec['estimator']()
+    if spec['param_grid']:
+        cv_model = GridSearchCV(
+            estimator=model,
+            param_grid=spec['param_grid'],
+            cv=5,
+            n_jobs=n_jobs)
+        cv_model.fit(X_train, y_train)
+        return cv_model.best_estimator_
+
+    model.fit(X_train, y_train)
+    return model
+
+
+def train_segment_models(X_train,
+                         y_train,
+                         segments,
+                         engine='rf',
+                         global_model=None,
+                         min_segment_size=MIN_SEGMENT_SIZE,
+                         n_jobs=-1):
+    '''
+    trains and tunes one model per segment, e.g. per Card_Category, in parallel worker
+    processes and saves the segment -> model map in MODELS_SAVE_FOLDER. Segments with
+    fewer than min_segment_size rows or a single class use the global model.
+    input:
+            X_train: X training data
+            y_train: y training data
+            segments: pandas series of the segment column aligned with X_train,
+                      e.g. df.loc[X_train.index, 'Card_Category']
+            engine: key of the engine in MODEL_ENGINES
+            global_model: fitted model of all segments, trained with engine if None
+            min_segment_size: minimum number of training rows of a segment model
+            n_jobs: number of worker processes, -1 for all cores
+
+    output:
+            segment_models: dict of the 'segment_column', the 'engine', the segment
+                            'models' and the 'global' model
+    '''
+    spec = MODEL_ENGINES[engine]
+    segment_values = np.asarray(segments)
+    y_values = np.asarray(y_train)
+
+    masks = {}
+    for segment in pd.unique(segment_values):
+        mask = segment_values == segment
+        if mask.sum() >= min_segment_size and len(np.unique(y_values[mask])) > 1:
+            masks[segment] = mask
+        else:
+            print('segment {} falls back to the global model'.format(segment))
+
+    # the grid search of every segment runs in its own worker
+    jobs = [delayed(fit_model_engine)(spec, X_train[mask], y_train[mask])
+            for mask in masks.values()]
+    if global_model is None:
+        jobs.append(delayed(fit_model_engine)(spec, X_train, y_train))
+    models = Parallel(n_jobs=n_jobs)(jobs)
+
+    segment_models = {
+        'segment_column': segments.name,
+        'engine': engine,
+        'models': dict(zip(masks, models)),
+        'global': models[-1] if global_model is None else global_model,
+    }
+    joblib.dump(segment_models, MODELS_SAVE_FOLDER + SEGMENT_MODELS_FILE)
+
+    return segment_models
+
+
+@numba.njit(parallel=True, cache=True)
+def _compact_forest_proba(X_data,
+                          roots,
+                          left,
+                          right,
+                          feature,
+                          threshold,
+                          value):
+    '''
+    averages the leaf class probabilities of every tree, rows run in parallel
+    '''
+    proba = np.zeros((X_data.shape[0], value.shape[1]))
+    for i in numba.prange(X_data.shape[0]):
+        for root in roots:
+            node = root
+            while left[node] != -1:
+                if X_data[i, feature[node]] <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            for j in range(value.shape[1]):
+                proba[i, j] += value[node, j]
+    return proba / len(roots)
+
+
+class CompactForest:
+    '''
+    random forest stored as flat node arrays with int32 indices and float32
+    thresholds and probabilities, optionally pruned to max_depth. Predicts like
+    RandomForestClassifier.predict_proba.
+    '''
+
+    def __init__(self, forest, trees=None, max_depth=None):
+        '''
+        input:
+            forest: fitted RandomForestClassifier or ExtraTreesClassifier
+            trees: indices of the trees to keep, all if None
+            max_depth: nodes deeper than max_depth are pruned, none if None
+        '''
+        if trees is None:
+            trees = range(len(forest.estimators_))
+
+        self.classes_ = forest.classes_
+        self.n_features_ = forest.estimators_[0].tree_.n_features
+        self.max_depth = max_depth
+
+        roots, left, right, feature, threshold, value = [], [], [], [], [], []
+        n_nodes = 0
+        for index in trees:
+            tree = forest.estimators_[index].tree_
+
+            # kept nodes in breadth first order, cut at max_depth
+            kept, level, depth = [], np.array([0]), 0
+            while level.size:
+                kept.append(level)
+                if max_depth is not None and depth == max_depth:
+                    break
+                level = level[tree.children_left[level] != -1]
+                level = np.concatenate(
+                    [tree.children_left[level], tree.children_right[level]])
+                depth += 1
+            kept = np.concatenate(kept)
+
+            new_ids = np.full(tree.node_count, -1, dtype=np.int64)
+            new_ids[kept] = np.arange(len(kept)) + n_nodes
+            # children outside of the kept nodes make pruned nodes leaves
+            kept_left = new_ids[np.maximum(tree.children_left[kept], 0)]
+            kept_right = new_ids[np.maximum(tree.children_right[kept], 0)]
+            is_leaf = (tree.children_left[kept] == -1) | (kept_left == -1)
+
+            # largest float32 not above the threshold keeps x <= threshold for
+            # float32 x, which is how sklearn compares
+            tree_threshold = tree.threshold[kept].astype(np.float32)
+            above = tree_threshold > tree.threshold[kept]
+            tree_threshold[above] = np.nextafter(
+                tree_threshold[above], np.float32(-np.inf))
+
+            tree_value = tree.value[kept, 0, :]
+            roots.append(n_nodes)
+            left.append(np.where(is_leaf, -1, kept_left))
+            right.append(np.where(is_leaf, -1, kept_right))
+            feature.append(np.where(is_leaf, 0, tree.feature[kept]))
+            threshold.append(tree_threshold)
+            value.append(tree_value / tree_value.sum(axis=1, keepdims=True))
+            n_nodes += len(kept)
+
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.left = np.concatenate(left).astype(np.int32)
+        self.right = np.concatenate(right).astype(np.int32)
+        self.feature = np.concatenate(feature).astype(np.int32)
+        self.threshold = np.concatenate(threshold).astype(np.float32)
+        self.value = np.concatenate(value).astype(np.float32)
+
+    def predict_proba(self, X_data):
+        '''
+        input:
+            X_data: X values
+        output:
+            proba: numpy array of class probabilities, shape (n_rows, n_classes)
+        '''
+        return _compact_forest_proba(
+            np.ascontiguousarray(X_data, dtype=np.float32),
+            self.roots,
+            self.left,
+            self.right,
+            self.feature,
+            self.threshold,
+            self.value)
+
+    def predict(self, X_data):
+        '''
+        input:
+            X_data: X values
+        output:
+            preds: numpy array of the most probable class of every row
+        '''
+        return self.classes_[np.argmax(self.predict_proba(X_data), axis=1)]
+
+
+def compact_forest(forest,
+                   X_val,
+                   y_val,
+                   auc_budget=0.005,
+                   max_trees=None,
+                   max_depth=None):
+    '''
+    shrinks a fitted random forest to the fewest trees and the smallest depth whose
+    held-out AUC stays within auc_budget of the full forest. Trees are added in
+    order of their own held-out AUC.
+    input:
+            forest: fitted RandomForestClassifier or ExtraTreesClassifier
+            X_val: held-out X values, not used for training
+            y_val: held-out y values
+            auc_budget: maximum loss of held-out AUC
+            max_trees: optional upper bound on the number of trees
+            max_depth: optional upper bound on the tree depth
+
+    output:
+            compact_model: CompactForest
+            summary: dict of the kept trees and depth and the held-out AUCs
+    '''
+    X_val = np.ascontiguousarray(X_val, dtype=np.float32)
+    tree_probs = np.stack([tree.predict_proba(X_val)[:, 1]
+                           for tree in forest.estimators_])
+    full_auc = roc_auc_score(y_val, tree_probs.mean(axis=0))
+    target_auc = full_auc - auc_budget
+
+    # AUC of the best k trees for every k
+    order = np.argsort([-roc_auc_score(y_val, probs) for probs in tree_probs],
+                       kind='stable')
+    cumulative = np.cumsum(tree_probs[order], axis=0)
+    n_trees = len(order) if max_trees is None else min(max_trees, len(order))
+    for k in range(1, n_trees + 1):
+        if roc_auc_score(y_val, cumulative[k - 1]) >= target_auc:
+            n_trees = k
+            break
+    trees = order[:n_trees]
+
+    # shallowest depth that still meets the target
+    depth = max_depth
+    for candidate in COMPACT_DEPTHS:
+        if max_depth is not None and candidate >= max_depth:
+            break
+        candidate_model = CompactForest(forest, trees, candidate)
+        if roc_auc_score(
+                y_val, candidate_model.predict_proba(X_val)[:, 1]) >= target_auc:
+            depth = candidate
+            break
+
+    compact_model = CompactForest(forest, trees, depth)
+    summary = {
+        'trees': n_trees,
+        'max_depth': depth,
+        'nodes': len(compact_model.left),
+        'full_auc': full_auc,
+        'compact_auc': roc_auc_score(
+            y_val, compact_model.predict_proba(X_val)[:, 1]),
+    }
+    return compact_model, summary
+
+
+def compare_model_artifacts(model_paths, X_data, y_data=None):
+    '''
+    measures file size, load time, predict throughput and AUC of saved models
+    input:
+            model_paths: dict of name -> path of a joblib saved model
+            X_data: X values to predict
+            y_data: optional y values, adds the AUC of every model
+
+    output:
+            results: pandas dataframe with one row per model
+    '''
+    results = []
+    for name, path in model_paths.items():
+        start = time.perf_counter()
+        model = joblib.load(path)
+        load_seconds = time.perf_counter() - start
+
+        # first call compiles the CompactForest kernel
+        model.predict_proba(X_data[:1])
+        start = time.perf_counter()
+        probs = model.predict_proba(X_data)[:, 1]
+        predict_seconds = time.perf_counter() - start
+
+        results.append({
+            'model': name,
+            'size_mb': os.path.getsize(path) / 2 ** 20,
+            'load_seconds': load_seconds,
+            'predict_rows_per_sec': len(X_data) / predict_seconds,
+        })
+        if y_data is not None:
+            results[-1]['auc'] = roc_auc_score(y_data, probs)
+
+    return pd.DataFrame(results)
+
+
+def compact_saved_forest(X_val,
+                         y_val,
+                         X_test,
+                         y_test,
+                         auc_budget=0.005,
+                         max_trees=None,
+                         max_depth=None):
+    '''
+    compacts the saved random forest, saves it as COMPACT_MODEL_FILE in
+    MODELS_SAVE_FOLDER and reports size, load time, throughput and test AUC before
+    and after
+    input:
+            X_val: held-out validation X values the compaction is tuned on, not
+                   used for training nor for the report
+            y_val: held-out validation y values
+            X_test: X testing data of the before and after report, not used
+                    for tuning
+            y_test: y testing data of the before and after report
+            auc_budget: maximum loss of validation AUC
+            max_trees: optional upper bound on the number of trees
+            max_depth: optional upper bound on the tree depth
+
+    output:
+            summary: dict of the kept trees and depth and the validation AUCs
+            results: output of compare_model_artifacts on the test data
+    '''
+    model_paths = {
+        'rfc_model': MODELS_SAVE_FOLDER + MODEL_ENGINES['rf']['model_file'],
+        'rfc_compact_model': MODELS_SAVE_FOLDER + COMPACT_MODEL_FILE,
+    }
+    compact_model, summary = compact_forest(
+        joblib.load(model_paths['rfc_model']),
+        X_val,
+        y_val,
+        auc_budget,
+        max_trees,
+        max_depth)
+    joblib.dump(compact_model, model_paths['rfc_compact_model'])
+
+    print('compact random forest: {}'.format(summary))
+    results = compare_model_artifacts(model_paths, X_test, y_test)
+    print(results.to_string(index=False))
+
+    return summary, results
+
+
+def model_report_image(model_name,
+                       y_train,
+                       y_test,
+                       y_train_preds,
+                       y_test_preds,
+                       save_file_name):
+    '''
+    produces classification report of one model for training and testing results and
+    stores report as image in images folder
+    input:
+            model_name: name of the model shown in the report
+            y_train: training response values
+            y_test:  test response values
+            y_train_preds: training predictions of the model
+            y_test_preds: test predictions of the model
+            save_file_name: file name of the image in RESULTS_IMAGE_SAVE_FOLDER
+
+    output:
+             None
+    '''
+    rendering.render_model_report(
+        rendering.report_metrics(model_name,
+                                 save_file_name,
+                                 y_train,
+                                 y_test,
+                                 y_train_preds,
+                                 y_test_preds),
+        RESULTS_IMAGE_SAVE_FOLDER)
+
+
 def classification_report_image(y_train,
                                 y_test,
                                 y_train_preds_lr,
@@ -240,127 +959,52 @@ def classification_report_image(y_train,
     output:
              None
     '''
-
-    def model_score_save(model_name,
-                         y_train,
-                         y_test,
-                         y_train_preds,
-                         y_test_preds,
-                         save_file_name):
-        plt.rc('figure', figsize=(5, 5))
-        # plt.text(0.01, 0.05, str(model.summary()), {'fontsize': 12}) old
-        # approach
-        plt.text(0.01, 1.25, str(model_name + ' Train'), {
-            'fontsize': 10}, fontproperties='monospace')
-        plt.text(0.01, 0.05, str(classification_report(y_test, y_test_preds)), {
-            'fontsize': 10}, fontproperties='monospace')  # approach improved by OP -> monospace!
-        plt.text(0.01, 0.6, str(model_name + ' Test'), {
-            'fontsize': 10}, fontproperties='monospace')
-        plt.text(0.01, 0.7, str(classification_report(y_train, y_train_preds)), {
-            'fontsize': 10}, fontproperties='monospace')  # approach improved by OP -> monospace!
-        plt.axis('off')
-        plt.tight_layout()
-        plt.savefig(os.path.join(RESULTS_IMAGE_SAVE_FOLDER, save_file_name))
-        plt.close()
-
     # random forrest model score save
-    model_score_save(
-        'Random Forest',
+    model_report_image(
+        MODEL_ENGINES['rf']['name'],
         y_train,
         y_test,
         y_train_preds_rf,
         y_test_preds_rf,
-        'rf_results.png')
+        MODEL_ENGINES['rf']['report_file'])
 
     # logistic regression model score save
-    model_score_save(
-        'Logistic Regression',
+    model_report_image(
+        MODEL_ENGINES['lr']['name'],
         y_train,
         y_test,
         y_train_preds_lr,
         y_test_preds_lr,
-        'logistic_results.png')
-
-    # plt.rc('figure', figsize=(5, 5))
-    # # plt.text(0.01, 0.05, str(model.summary()), {'fontsize': 12}) old approach
-    # plt.text(0.01, 1.25, str('Random Forest Train'), {
-    #          'fontsize': 10}, fontproperties='monospace')
-    # plt.text(0.01, 0.05, str(classification_report(y_test, y_test_preds_rf)), {
-    #          'fontsize': 10}, fontproperties='monospace')  # approach improved by OP -> monospace!
-    # plt.text(0.01, 0.6, str('Random Forest Test'), {
-    #          'fontsize': 10}, fontproperties='monospace')
-    # plt.text(0.01, 0.7, str(classification_report(y_train, y_train_preds_rf)), {
-    #          'fontsize': 10}, fontproperties='monospace')  # approach improved by OP -> monospace!
-    # plt.axis('off')
-    # plt.savefig(os.path.join(RESULTS_IMAGE_SAVE_FOLDER, 'rf_results.png'))
-
-    # #
-    # plt.rc('figure', figsize=(5, 5))
-    # plt.text(0.01, 1.25, str('Logistic Regression Train'),
-    #          {'fontsize': 10}, fontproperties='monospace')
-    # plt.text(0.01, 0.05, str(classification_report(y_train, y_train_preds_lr)), {
-    #          'fontsize': 10}, fontproperties='monospace')  # approach improved by OP -> monospace!
-    # plt.text(0.01, 0.6, str('Logistic Regression Test'), {
-    #          'fontsize': 10}, fontproperties='monospace')
-    # plt.text(0.01, 0.7, str(classification_report(y_test, y_test_preds_lr)), {
-    #          'fontsize': 10}, fontproperties='monospace')  # approach improved by OP -> monospace!
-    # plt.axis('off')
-    # plt.savefig(
-    #     os.path.join(
-    #         RESULTS_IMAGE_SAVE_FOLDER,
-    #         'logistic_regression_report_.png'
-    #     )
-    # )
+        MODEL_ENGINES['lr']['report_file'])
 
 
 def feature_importance_plot(model, X_data, output_pth):
     '''
     creates and stores the feature importances in pth
     input:
-            model: model object containing feature_importances_
-            X_data: pandas dataframe of X values
+            model: model object containing feature_importances_, either fitted
+                   estimator or GridSearchCV object
+            X_data: pandas dataframe of X values, or numpy array of quantized
+                    FEATURE_COLUMNS values
             output_pth: path to store the figure
 
     output:
              None
     '''
-
-    # Calculate feature importances
-    importances = model.best_estimator_.feature_importances_
-    # Sort feature importances in descending order
-    indices = np.argsort(importances)[::-1]
-
-    # Rearrange feature names so they match the sorted feature importances
-    names = [X_data.columns[i] for i in indices]
-
-    # Create plot
-    plt.figure(figsize=(20, 5))
-
-    # Create plot title
-    plt.title("Feature Importance")
-    plt.ylabel('Importance')
-
-    # Add bars
-    plt.bar(range(X_data.shape[1]), importances[indices])
-
-    # Add feature names as x-axis labels
-    plt.xticks(range(X_data.shape[1]), names, rotation=90)
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_pth, 'feature_importance.png'))
-    plt.close()
-
-    # calculate feature impact
-    explainer = shap.TreeExplainer(model.best_estimator_)
-    shap_values = explainer.shap_values(X_data)
-    shap.summary_plot(shap_values, X_data, plot_type="bar", show=False)
-    plt.tight_layout()
-    plt.savefig(
-        os.path.join(output_pth, 'feature_impact.png')
-    )
-    plt.close()
-
-
-def train_models(X_train, X_test, y_train, y_test):
+    metrics = rendering.importance_metrics(
+        model, X_data, getattr(X_data, 'columns', FEATURE_COLUMNS))
+    rendering.render_feature_importance(metrics, output_pth)
+    rendering.render_feature_impact(metrics, output_pth)
+
+
+def train_models(X_train,
+                 X_test,
+                 y_train,
+                 y_test,
+                 engines=None,
+                 importance_engine='rf',
+                 results_mode='image',
+                 compare_solvers=False):
     '''
     train, store model results: images + scores, and store models
     input:
@@ -368,81 +1012,71 @@ def train_models(X_train, X_test, y_train, y_test):
               X_test: X testing data
               y_train: y training data
               y_test: y testing data
-    output:
-              None
-    '''
-    # grid search
-    rfc = RandomForestClassifier(random_state=42)
-    # Use a different solver if the default 'lbfgs' fails to converge
-    # Reference:
-    # https://scikit-learn.org/stable/modules/linear_model.html#logistic-regression
-    lrc = LogisticRegression(solver='lbfgs', max_iter=3000)
-
-    param_grid = {
-        'n_estimators': [200, 500],
-        'max_features': ['auto', 'sqrt'],
-        'max_depth': [4, 5, 100],
-        'criterion': ['gini', 'entropy']
-    }
+              engines: list of MODEL_ENGINES keys to train, DEFAULT_ENGINES if None
+              importance_engine: engine used for the feature importance plots,
+                                 must be a tree model supported by shap
+              results_mode: 'image' renders all result images concurrently,
+                            'text' stores text reports and json metrics only
+              compare_solvers: if True, refits logistic regression with every
+                               solver and stores their convergence, on top of
+                               the grid search
 
-    # train models
-    cv_rfc = GridSearchCV(estimator=rfc, param_grid=param_grid, cv=5)
-    cv_rfc.fit(X_train, y_train)
-
-    lrc.fit(X_train, y_train)
-
-    y_train_preds_rf = cv_rfc.best_estimator_.predict(X_train)
-    y_test_preds_rf = cv_rfc.best_estimator_.predict(X_test)
-
-    y_train_preds_lr = lrc.predict(X_train)
-    y_test_preds_lr = lrc.predict(X_test)
-
-    # scores
-    print('random forest results')
-    print('test results')
-    print(classification_report(y_test, y_test_preds_rf))
-    print('train results')
-    print(classification_report(y_train, y_train_preds_rf))
-
-    print('logistic regression results')
-    print('test results')
-    print(classification_report(y_test, y_test_preds_lr))
-    print('train results')
-    print(classification_report(y_train, y_train_preds_lr))
-
-    # store model scores
-    classification_report_image(y_train,
-                                y_test,
-                                y_train_preds_lr,
-                                y_train_preds_rf,
-                                y_test_preds_lr,
-                                y_test_preds_rf)
-
-    # ROC curves
-    lrc_plot = plot_roc_curve(lrc, X_test, y_test)
+    output:
+              models: dict of engine key -> fitted model
+    '''
+    if engines is None:
+        engines = DEFAULT_ENGINES
+
+    models = {}
+    metrics = {'models': [], 'importance': None}
+    for engine in engines:
+        spec = MODEL_ENGINES[engine]
+
+        # train (and tune) model
+        model = fit_model_engine(engine, X_train, y_train)
+        models[engine] = model
+
+        # scores
+        model_metrics = rendering.model_metrics(spec['name'],
+                                                spec['report_file'],
+                                                model,
+                                                X_train,
+                                                X_test,
+                                                y_train,
+                                                y_test)
+        metrics['models'].append(model_metrics)
+        print(spec['name'].lower() + ' results')
+        print('test results')
+        print(model_metrics['test_report'])
+        print('train results')
+        print(model_metrics['train_report'])
+
+        # save best model
+        joblib.dump(model, MODELS_SAVE_FOLDER + spec['model_file'])
+
+    # logistic regression convergence of every solver
+    if compare_solvers and 'lr' in models:
+        solvers = compare_logistic_solvers(X_train, X_test, y_train, y_test)
+        print('logistic regression solvers')
+        print(solvers.to_string(index=False))
+        solvers.to_csv(
+            os.path.join(RESULTS_IMAGE_SAVE_FOLDER, 'logistic_solvers.csv'),
+            index=False)
 
-    plt.figure(figsize=(15, 8))
-    ax = plt.gca()
-    _ = plot_roc_curve(
-        cv_rfc.best_estimator_,
-        X_test,
-        y_test,
-        ax=ax,
-        alpha=0.8)
-    lrc_plot.plot(ax=ax, alpha=0.8)
-    # plt.show()
-    plt.savefig(
-        os.path.join(
-            RESULTS_IMAGE_SAVE_FOLDER,
-            'roc_curve_result.png'))
-    plt.close()
+    # feature importance
+    if importance_engine in models:
+        metrics['importance'] = rendering.importance_metrics(
+            models[importance_engine],
+            X_train,
+            getattr(X_train, 'columns', FEATURE_COLUMNS))
 
-    # save best models
-    joblib.dump(cv_rfc.best_estimator_, MODELS_SAVE_FOLDER + 'rfc_model.pkl')
-    joblib.dump(lrc, MODELS_SAVE_FOLDER + 'logistic_model.pkl')
+    # store model scores, ROC curves and feature importance
+    if results_mode == 'text':
+        rendering.write_results_text(metrics, RESULTS_IMAGE_SAVE_FOLDER)
+    else:
+        rendering.render_results(metrics, RESULTS_IMAGE_SAVE_FOLDER)
 
-    # feature importance
-    feature_importance_plot(cv_rfc, X_train, RESULTS_IMAGE_SAVE_FOLDER)
+    return models
 
 
 if __name__ == "__main__":
@@ -468,3 +1102,11 @@ if __name__ == "__main__":
     print('Training Models')
     train_models(_X_train, _X_test, _y_train, _y_test)
     print('Training Models Complete')
+
+    # shrink the tuned random forest for faster loading and prediction, tuned on
+    # one half of the test data and reported on the other half
+    print('Compacting Random Forest')
+    _X_val, _X_report, _y_val, _y_report = train_test_split(
+        _X_test, _y_test, test_size=0.5, random_state=42)
+    compact_saved_forest(_X_val, _y_val, _X_report, _y_report)
+    print('Compacting Random Forest Complete')
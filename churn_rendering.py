@@ -0,0 +1,307 @@
+"""
+Rendering of the model results from precomputed metrics
+
+Every artifact is drawn on its own Figure with the Agg canvas instead of the
+global pyplot state, so the result images can render concurrently.
+
+author: Mohammad Khan
+Date: 19 October, 2026
+"""
+
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from sklearn.metrics import classification_report, roc_curve, roc_auc_score
+import shap
+
+ROC_CURVE_FILE = 'roc_curve_result.png'
+FEATURE_IMPORTANCE_FILE = 'feature_importance.png'
+FEATURE_IMPACT_FILE = 'feature_impact.png'
+RESULTS_JSON_FILE = 'results.json'
+
+
+def report_metrics(model_name,
+                   report_file,
+                   y_train,
+                   y_test,
+                   y_train_preds,
+                   y_test_preds):
+    '''
+    computes the classification reports of one model once, for printing, images
+    and json
+
+    input:
+        model_name: name of the model shown in the report
+        report_file: file name of the report image
+        y_train: training response values
+        y_test:  test response values
+        y_train_preds: training predictions of the model
+        y_test_preds: test predictions of the model
+
+    output:
+        metrics: dict of the model name, report file, text and dict reports
+    '''
+    return {
+        'name': model_name,
+        'report_file': report_file,
+        'train_report': classification_report(y_train, y_train_preds),
+        'test_report': classification_report(y_test, y_test_preds),
+        'train_scores': classification_report(
+            y_train, y_train_preds, output_dict=True),
+        'test_scores': classification_report(
+            y_test, y_test_preds, output_dict=True),
+    }
+
+
+def model_metrics(model_name,
+                  report_file,
+                  model,
+                  X_train,
+                  X_test,
+                  y_train,
+                  y_test):
+    '''
+    computes the classification reports and the test ROC curve of a fitted model
+
+    input:
+        model_name: name of the model shown in the report and ROC plot
+        report_file: file name of the report image
+        model: fitted model with predict_proba
+        X_train: X training data
+        X_test: X testing data
+        y_train: y training data
+        y_test: y testing data
+
+    output:
+        metrics: report_metrics dict with the 'roc' false and true positive rates
+                 and AUC
+    '''
+    # one predict_proba call gives both the predictions and the ROC curve
+    y_test_proba = model.predict_proba(X_test)
+    y_test_probs = y_test_proba[:, 1]
+    y_test_preds = model.classes_[np.argmax(y_test_proba, axis=1)]
+
+    metrics = report_metrics(model_name,
+                             report_file,
+                             y_train,
+                             y_test,
+                             model.predict(X_train),
+                             y_test_preds)
+
+    fpr, tpr, _ = roc_curve(y_test, y_test_probs)
+    metrics['roc'] = {
+        'fpr': fpr.tolist(),
+        'tpr': tpr.tolist(),
+        'auc': roc_auc_score(y_test, y_test_probs),
+    }
+    return metrics
+
+
+def importance_metrics(model, X_data, feature_names):
+    '''
+    computes the feature importances and the mean absolute SHAP values of a tree
+    model
+
+    input:
+        model: fitted tree model containing feature_importances_ and supported by
+               shap.TreeExplainer, either fitted estimator or GridSearchCV object
+        X_data: X values
+        feature_names: names of the X columns
+
+    output:
+        metrics: dict of 'feature_names', 'importances' and 'shap_importances'
+    '''
+    model = getattr(model, 'best_estimator_', model)
+    if not hasattr(model, 'feature_importances_'):
+        raise ValueError('feature importances need a tree model, got {}'.format(
+            type(model).__name__))
+    importances = model.feature_importances_
+
+    shap_values = shap.TreeExplainer(model).shap_values(X_data)
+    if isinstance(shap_values, list):
+        # one array per class, the churn class drives the ranking
+        shap_values = shap_values[1]
+
+    return {
+        'feature_names': list(feature_names),
+        'importances': np.asarray(importances).tolist(),
+        'shap_importances': np.abs(shap_values).mean(axis=0).tolist(),
+    }
+
+
+def _save_figure(fig, path):
+    '''
+    saves a figure through its own Agg canvas
+    '''
+    FigureCanvasAgg(fig)
+    fig.savefig(path)
+    return path
+
+
+def render_model_report(metrics, output_pth):
+    '''
+    stores the classification report of one model as image
+
+    input:
+        metrics: output of report_metrics or model_metrics
+        output_pth: folder of the image
+
+    output:
+        path: path of the stored image
+    '''
+    fig = Figure(figsize=(5, 5))
+    ax = fig.add_subplot()
+    font = {'fontsize': 10}
+    ax.text(0.01, 1.25, metrics['name'] + ' Train', font,
+            fontproperties='monospace')
+    ax.text(0.01, 0.05, metrics['test_report'], font,
+            fontproperties='monospace')
+    ax.text(0.01, 0.6, metrics['name'] + ' Test', font,
+            fontproperties='monospace')
+    ax.text(0.01, 0.7, metrics['train_report'], font,
+            fontproperties='monospace')
+    ax.axis('off')
+    fig.tight_layout()
+    return _save_figure(fig, os.path.join(output_pth, metrics['report_file']))
+
+
+def render_roc_curves(models_metrics, output_pth):
+    '''
+    stores the test ROC curves of all models in one image
+
+    input:
+        models_metrics: list of model_metrics outputs
+        output_pth: folder of the image
+
+    output:
+        path: path of the stored image
+    '''
+    fig = Figure(figsize=(15, 8))
+    ax = fig.add_subplot()
+    for metrics in models_metrics:
+        ax.plot(metrics['roc']['fpr'],
+                metrics['roc']['tpr'],
+                label='{} (AUC = {:.2f})'.format(
+                    metrics['name'], metrics['roc']['auc']),
+                alpha=0.8)
+    ax.set_xlabel('False Positive Rate')
+    ax.set_ylabel('True Positive Rate')
+    ax.legend(loc='lower right')
+    return _save_figure(fig, os.path.join(output_pth, ROC_CURVE_FILE))
+
+
+def render_feature_importance(metrics, output_pth):
+    '''
+    stores the feature importances as image
+
+    input:
+        metrics: output of importance_metrics
+        output_pth: folder of the image
+
+    output:
+        path: path of the stored image
+    '''
+    importances = np.asarray(metrics['importances'])
+    # Sort feature importances in descending order
+    indices = np.argsort(importances)[::-1]
+    names = [metrics['feature_names'][i] for i in indices]
+
+    fig = Figure(figsize=(20, 5))
+    ax = fig.add_subplot()
+    ax.set_title("Feature Importance")
+    ax.set_ylabel('Importance')
+    ax.bar(range(len(names)), importances[indices])
+    ax.set_xticks(range(len(names)))
+    ax.set_xticklabels(names, rotation=90)
+    fig.tight_layout()
+    return _save_figure(fig, os.path.join(output_pth, FEATURE_IMPORTANCE_FILE))
+
+
+def render_feature_impact(metrics, output_pth):
+    '''
+    stores the mean absolute SHAP value of every feature as image, like
+    shap.summary_plot(plot_type="bar")
+
+    input:
+        metrics: output of importance_metrics
+        output_pth: folder of the image
+
+    output:
+        path: path of the stored image
+    '''
+    impacts = np.asarray(metrics['shap_importances'])
+    # largest impact on top
+    indices = np.argsort(impacts)
+    names = [metrics['feature_names'][i] for i in indices]
+
+    fig = Figure(figsize=(8, 0.4 * len(names) + 1.5))
+    ax = fig.add_subplot()
+    ax.barh(range(len(names)), impacts[indices], color='#1E88E5')
+    ax.set_yticks(range(len(names)))
+    ax.set_yticklabels(names)
+    ax.set_xlabel('mean(|SHAP value|) (average impact on model output magnitude)')
+    fig.tight_layout()
+    return _save_figure(fig, os.path.join(output_pth, FEATURE_IMPACT_FILE))
+
+
+def write_results_text(metrics, output_pth):
+    '''
+    headless alternative to render_results: stores the classification reports as
+    text files and all metrics as json, without drawing anything
+
+    input:
+        metrics: dict of 'models' (list of model_metrics outputs) and optional
+                 'importance' (importance_metrics output)
+        output_pth: folder of the files
+
+    output:
+        paths: list of paths of the stored files
+    '''
+    paths = []
+    for model in metrics['models']:
+        path = os.path.join(
+            output_pth, os.path.splitext(model['report_file'])[0] + '.txt')
+        with open(path, 'w') as report:
+            report.write('{} Train\n{}\n{} Test\n{}'.format(
+                model['name'], model['train_report'],
+                model['name'], model['test_report']))
+        paths.append(path)
+
+    path = os.path.join(output_pth, RESULTS_JSON_FILE)
+    with open(path, 'w') as results:
+        # numpy scalars of the reports are written as floats
+        json.dump(metrics, results, indent=2, default=float)
+    paths.append(path)
+
+    return paths
+
+
+def render_results(metrics, output_pth, executor='process', max_workers=None):
+    '''
+    renders all result images at the same time
+
+    input:
+        metrics: dict of 'models' (list of model_metrics outputs) and optional
+                 'importance' (importance_metrics output)
+        output_pth: folder of the images
+        executor: 'process' or 'thread' pool. Processes are the safe default,
+                  matplotlib shares its font objects between threads
+        max_workers: maximum number of workers of the pool
+
+    output:
+        paths: list of paths of the stored images
+    '''
+    tasks = [(render_model_report, model) for model in metrics['models']]
+    tasks.append((render_roc_curves, metrics['models']))
+    if metrics.get('importance') is not None:
+        tasks.append((render_feature_importance, metrics['importance']))
+        tasks.append((render_feature_impact, metrics['importance']))
+
+    pool = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    with pool(max_workers=max_workers) as workers:
+        futures = [workers.submit(render, artifact_metrics, output_pth)
+                   for render, artifact_metrics in tasks]
+        return [future.result() for future in futures]
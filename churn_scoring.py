@@ -0,0 +1,484 @@
+"""
+Batch scoring of customers with the models saved by churn_library
+
+author: Mohammad Khan
+Date: 19 October, 2026
+"""
+
+import os
+import sys
+import time
+from functools import partial
+import numpy as np
+import pandas as pd
+import joblib
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.pipeline import Pipeline
+import shap
+import churn_library as cls
+
+# constants
+SCORES_SAVE_FOLDER = 'scores/'
+SCORES_FILE = 'churn_scores.csv'
+DELTA_STATE_FILE = 'delta_state.pkl'
+ID_COLUMN = 'CLIENTNUM'
+# columns of score_customers without explanations
+SCORE_COLUMNS = [ID_COLUMN, 'churn_probability', 'churn_prediction']
+# rows per leaf lookup batch of the fast explanations, bounds the memory of the
+# (rows, trees) leaf matrix
+EXPLAIN_BATCH_SIZE = 20_000
+
+CATEGORY_COLUMNS = [
+    'Gender',
+    'Education_Level',
+    'Marital_Status',
+    'Income_Category',
+    'Card_Category']
+
+QUANT_COLUMNS = [
+    column for column in cls.FEATURE_COLUMNS
+    if not column.endswith('_Churn')]
+
+# raw extract columns the model features are built from
+RAW_FEATURE_COLUMNS = QUANT_COLUMNS + CATEGORY_COLUMNS
+
+
+def load_scoring_artifacts(model_file='rfc_model.pkl', quantized=False):
+    '''
+    loads the saved model and the feature engineering artifacts needed to score
+
+    input:
+        model_file: file name of the model in cls.MODELS_SAVE_FOLDER, or
+                    cls.SEGMENT_MODELS_FILE to route customers to their segment model
+        quantized: True if the model was trained on quantized X data
+
+    output:
+        artifacts: dict with the 'model', category 'encodings', 'bin_edges' (None if
+                   not quantized) and a 'fingerprint' of the artifact files
+    '''
+    paths = [cls.MODELS_SAVE_FOLDER + model_file,
+             cls.MODELS_SAVE_FOLDER + cls.CATEGORY_ENCODINGS_FILE]
+    if quantized:
+        paths.append(cls.MODELS_SAVE_FOLDER + cls.BIN_EDGES_FILE)
+
+    # artifacts are rewritten by training, so size and mtime identify them
+    fingerprint = ';'.join(
+        '{}:{}:{}'.format(path, os.stat(path).st_size, os.stat(path).st_mtime_ns)
+        for path in paths)
+
+    return {
+        'model': joblib.load(paths[0]),
+        'encodings': joblib.load(paths[1]),
+        'bin_edges': joblib.load(paths[2]) if quantized else None,
+        'fingerprint': fingerprint,
+    }
+
+
+def build_features(df, artifacts):
+    '''
+    builds the model features of a raw extract with the saved category encodings
+
+    input:
+        df: pandas dataframe shaped like bank_data.csv, Attrition_Flag not needed
+        artifacts: output of load_scoring_artifacts
+
+    output:
+        data_X: pandas dataframe of cls.FEATURE_COLUMNS, or uint8 numpy array if the
+                artifacts have bin_edges
+    '''
+    data_X = df[QUANT_COLUMNS].copy()
+    for category, encoding in artifacts['encodings'].items():
+        # categories unseen in training get the mean churn of the column
+        data_X[category + '_Churn'] = df[category].map(
+            encoding).fillna(encoding.mean()).to_numpy()
+    data_X = data_X[cls.FEATURE_COLUMNS]
+
+    if artifacts['bin_edges'] is not None:
+        return cls.apply_bin_edges(data_X, artifacts['bin_edges'])
+    return data_X
+
+
+def path_sum_tables(model):
+    '''
+    tabulates once per model, for every node of every tree, the sum of the
+    changes of the node churn probability per feature on the path from the root
+    (Saabas). Logistic regression pipelines need no tables.
+
+    input:
+        model: fitted random forest, extra trees, decision tree or logistic pipeline
+
+    output:
+        tables: list of numpy arrays of shape (node_count, n_features), one per
+                tree, or None for logistic pipelines
+    '''
+    if isinstance(model, Pipeline):
+        return None
+
+    trees = getattr(model, 'estimators_', [model])
+    if not all(hasattr(tree, 'tree_') for tree in trees):
+        raise ValueError('fast explanations need a forest of decision trees, use '
+                         'exact explanations for {}'.format(type(model).__name__))
+
+    tables = []
+    for tree in trees:
+        tree = tree.tree_
+        value = tree.value[:, 0, :]
+        churn = value[:, 1] / value.sum(axis=1)
+
+        # one vectorized step per tree level
+        path_sums = np.zeros((tree.node_count, tree.n_features))
+        level = np.array([0])
+        while level.size:
+            level = level[tree.children_left[level] != -1]
+            for children in [tree.children_left[level],
+                             tree.children_right[level]]:
+                path_sums[children] = path_sums[level]
+                path_sums[children, tree.feature[level]] += (
+                    churn[children] - churn[level])
+            level = np.concatenate(
+                [tree.children_left[level], tree.children_right[level]])
+        tables.append(path_sums)
+
+    return tables
+
+
+def path_contributions(model, X_data, tables=None):
+    '''
+    fast approximate per row feature contributions to the churn probability: every
+    split on a decision path adds the change of the node churn probability to its
+    feature. With the path_sum_tables of the model, rows only need a leaf lookup.
+    Standardized logistic regression pipelines get exact log-odds contributions.
+
+    input:
+        model: fitted random forest, extra trees, decision tree or logistic pipeline
+        X_data: X values of the rows to explain
+        tables: output of path_sum_tables(model), computed if None
+
+    output:
+        contributions: numpy array of shape (n_rows, n_features)
+    '''
+    if isinstance(model, Pipeline):
+        # linear in the scaled features, which are centered on the training mean
+        return model[:-1].transform(X_data) * model[-1].coef_[0]
+
+    if tables is None:
+        tables = path_sum_tables(model)
+
+    contributions = np.zeros((len(X_data), tables[0].shape[1]))
+    for start in range(0, len(X_data), EXPLAIN_BATCH_SIZE):
+        batch = X_data[start:start + EXPLAIN_BATCH_SIZE]
+        # leaf of every row in every tree, shape (n_rows, n_trees)
+        leaves = model.apply(batch).reshape(len(batch), len(tables))
+        rows = slice(start, start + len(batch))
+        for i, path_sums in enumerate(tables):
+            contributions[rows] += path_sums[leaves[:, i]]
+
+    return contributions / len(tables)
+
+
+def exact_contributions(model, X_data):
+    '''
+    exact per row SHAP values of the churn class with shap.TreeExplainer
+
+    input:
+        model: fitted tree model supported by shap
+        X_data: X values of the rows to explain
+
+    output:
+        contributions: numpy array of shape (n_rows, n_features)
+    '''
+    shap_values = shap.TreeExplainer(model).shap_values(
+        X_data, check_additivity=False)
+    if isinstance(shap_values, list):
+        # one array per class for classifiers with predict_proba outputs
+        shap_values = shap_values[1]
+    return np.asarray(shap_values)
+
+
+# explanation methods of explain_customers
+EXPLAIN_METHODS = {
+    'fast': path_contributions,
+    'exact': exact_contributions,
+}
+
+
+def explain_customers(model, X_data, method='fast', top_k=3, n_jobs=-1):
+    '''
+    returns the top_k churn drivers of every row, the features with the largest
+    contributions towards churn. The rows are split in one part per worker
+    process, so the model and its path_sum_tables are sent once to every worker.
+
+    input:
+        model: fitted model
+        X_data: X values of the rows to explain, in cls.FEATURE_COLUMNS order
+        method: 'fast' path based contributions or 'exact' SHAP values
+        top_k: number of drivers per row
+        n_jobs: number of worker processes, -1 for all cores
+
+    output:
+        reasons: pandas dataframe of reason_<i> feature names and
+                 reason_<i>_contribution values for i in 1..top_k
+    '''
+    start = time.perf_counter()
+
+    explain = EXPLAIN_METHODS[method]
+    if explain is path_contributions:
+        # tabulated once per model, not once per part
+        explain = partial(path_contributions, tables=path_sum_tables(model))
+
+    n_parts = min(effective_n_jobs(n_jobs),
+                  -(-len(X_data) // EXPLAIN_BATCH_SIZE))
+    if n_parts > 1:
+        bounds = np.linspace(0, len(X_data), n_parts + 1).astype(int)
+        contributions = np.vstack(Parallel(n_jobs=n_parts)(
+            delayed(explain)(model, X_data[first:last])
+            for first, last in zip(bounds[:-1], bounds[1:])))
+    else:
+        contributions = explain(model, X_data)
+
+    top = np.argsort(-contributions, axis=1, kind='stable')[:, :top_k]
+    names = np.asarray(cls.FEATURE_COLUMNS)[top]
+    values = np.take_along_axis(contributions, top, axis=1)
+
+    reasons = {}
+    for i in range(top.shape[1]):
+        reasons['reason_{}'.format(i + 1)] = names[:, i]
+        reasons['reason_{}_contribution'.format(i + 1)] = values[:, i]
+
+    print('{} explanations: {:.0f} rows/sec'.format(
+        method, len(X_data) / (time.perf_counter() - start)))
+    return pd.DataFrame(reasons)
+
+
+def model_routes(df, model):
+    '''
+    routes every customer to the model scoring it, segment model maps of
+    cls.train_segment_models route by the segment column, unknown and small
+    segments go to the global model
+
+    input:
+        df: pandas dataframe shaped like bank_data.csv
+        model: fitted model or segment model map
+
+    output:
+        routes: list of (boolean numpy array of the routed rows, model) pairs
+    '''
+    if not isinstance(model, dict):
+        return [(np.ones(len(df), dtype=bool), model)]
+
+    segments = df[model['segment_column']].to_numpy()
+    routed = np.zeros(len(df), dtype=bool)
+
+    routes = []
+    for segment, segment_model in model['models'].items():
+        rows = segments == segment
+        if rows.any():
+            routes.append((rows, segment_model))
+            routed |= rows
+    if not routed.all():
+        routes.append((~routed, model['global']))
+    return routes
+
+
+def score_customers(df, artifacts, explain=None, top_k=3, n_jobs=-1):
+    '''
+    scores every customer of a raw extract
+
+    input:
+        df: pandas dataframe shaped like bank_data.csv
+        artifacts: output of load_scoring_artifacts
+        explain: None, or 'fast' / 'exact' to add the top_k churn drivers of every
+                 customer, see explain_customers
+        top_k: number of churn drivers per customer
+        n_jobs: number of worker processes for the explanations
+
+    output:
+        scores: pandas dataframe of ID_COLUMN, churn_probability, churn_prediction
+                and the churn drivers if explain is set
+    '''
+    data_X = build_features(df, artifacts)
+
+    churn_probability = np.empty(len(df))
+    reasons = []
+    for rows, model in model_routes(df, artifacts['model']):
+        routed_X = data_X if rows.all() else data_X[rows]
+        churn_probability[rows] = model.predict_proba(routed_X)[:, 1]
+
+        if explain is not None:
+            routed_reasons = explain_customers(
+                model, routed_X, explain, top_k, n_jobs)
+            routed_reasons.index = np.flatnonzero(rows)
+            reasons.append(routed_reasons)
+
+    scores = pd.DataFrame({
+        ID_COLUMN: df[ID_COLUMN].to_numpy(),
+        'churn_probability': churn_probability,
+        'churn_prediction': (churn_probability >= 0.5).astype(int),
+    })
+
+    if explain is not None:
+        scores = pd.concat([scores, pd.concat(reasons).sort_index()], axis=1)
+    return scores
+
+
+def hash_feature_rows(df):
+    '''
+    hashes the raw feature columns of every customer in one vectorized pass
+
+    input:
+        df: pandas dataframe shaped like bank_data.csv
+
+    output:
+        hashes: pandas series of uint64 row hashes indexed by ID_COLUMN
+    '''
+    hashes = pd.Series(
+        pd.util.hash_pandas_object(
+            df[RAW_FEATURE_COLUMNS], index=False).to_numpy(),
+        index=pd.Index(df[ID_COLUMN].to_numpy(), name=ID_COLUMN))
+
+    if hashes.index.has_duplicates:
+        raise ValueError('{} must be unique to delta score'.format(ID_COLUMN))
+    return hashes
+
+
+def detect_changes(hashes, previous_hashes):
+    '''
+    compares the row hashes of the current extract with the previous run
+
+    input:
+        hashes: output of hash_feature_rows for the current extract
+        previous_hashes: output of hash_feature_rows for the previous extract
+
+    output:
+        changes: dict of boolean numpy arrays 'new' and 'changed' aligned with hashes,
+                 and the index of 'deleted' customers
+    '''
+    seen = hashes.index.isin(previous_hashes.index)
+
+    changed = np.zeros(len(hashes), dtype=bool)
+    changed[seen] = hashes.to_numpy()[seen] != previous_hashes.reindex(
+        hashes.index[seen]).to_numpy()
+
+    return {
+        'new': ~seen,
+        'changed': changed,
+        'deleted': previous_hashes.index[
+            ~previous_hashes.index.isin(hashes.index)],
+    }
+
+
+def delta_score(df, artifacts, state=None):
+    '''
+    scores only the new and changed customers and merges them into the previous
+    scores, everything is rescored if there is no state or the artifacts changed
+
+    input:
+        df: pandas dataframe shaped like bank_data.csv
+        artifacts: output of load_scoring_artifacts
+        state: state returned by the previous delta_score run, or None
+
+    output:
+        scores: pandas dataframe of scores in the row order of df
+        state: state to pass to the next run
+        stats: dict of row counts, fraction of rows skipped and timings
+    '''
+    start = time.perf_counter()
+    hashes = hash_feature_rows(df)
+    fingerprint = artifacts.get('fingerprint') or joblib.hash(
+        [artifacts['model'], artifacts['encodings'], artifacts['bin_edges']])
+
+    reuse = state is not None and state['fingerprint'] == fingerprint
+    changes = detect_changes(
+        hashes, state['hashes'] if reuse else hashes.iloc[:0])
+    rescore = changes['new'] | changes['changed']
+    hash_seconds = time.perf_counter() - start
+
+    n_rescored = int(rescore.sum())
+
+    start = time.perf_counter()
+    if not n_rescored:
+        # nothing changed or the extract is empty, models reject zero rows
+        if reuse:
+            scores = state['scores'].set_index(ID_COLUMN).reindex(
+                hashes.index).reset_index()
+        else:
+            scores = pd.DataFrame(columns=SCORE_COLUMNS)
+    elif n_rescored == len(df):
+        scores = score_customers(df, artifacts)
+    else:
+        scores = [state['scores'].set_index(ID_COLUMN).reindex(
+            hashes.index[~rescore])]
+        if n_rescored:
+            scores.append(score_customers(
+                df[rescore], artifacts).set_index(ID_COLUMN))
+        scores = pd.concat(scores).reindex(hashes.index).reset_index()
+    scoring_seconds = time.perf_counter() - start
+
+    # the cost of scoring every row is measured on full runs only, small
+    # deltas are dominated by fixed overhead
+    if n_rescored == len(df) and n_rescored:
+        seconds_per_row = scoring_seconds / n_rescored
+    elif state is not None:
+        seconds_per_row = state['seconds_per_row']
+    else:
+        seconds_per_row = 0.0
+
+    n_skipped = len(df) - n_rescored
+    stats = {
+        'rows': len(df),
+        'new': int(changes['new'].sum()),
+        'changed': int(changes['changed'].sum()),
+        'deleted': len(changes['deleted']),
+        'rescored': n_rescored,
+        'skipped_fraction': n_skipped / len(df) if len(df) else 0.0,
+        'hash_seconds': hash_seconds,
+        'scoring_seconds': scoring_seconds,
+        'saved_seconds': (seconds_per_row * len(df)
+                          - hash_seconds - scoring_seconds),
+    }
+
+    state = {
+        'fingerprint': fingerprint,
+        'hashes': hashes,
+        'scores': scores,
+        'seconds_per_row': seconds_per_row,
+    }
+    return scores, state, stats
+
+
+def run_delta_scoring(pth, model_file='rfc_model.pkl', quantized=False):
+    '''
+    delta scores the extract at pth, reusing and updating the state and the scores
+    saved in SCORES_SAVE_FOLDER by the previous run
+
+    input:
+        pth: a path to the csv extract
+        model_file: file name of the model in cls.MODELS_SAVE_FOLDER
+        quantized: True if the model was trained on quantized X data
+
+    output:
+        stats: dict of row counts, fraction of rows skipped and timings
+    '''
+    state_pth = os.path.join(SCORES_SAVE_FOLDER, DELTA_STATE_FILE)
+    state = joblib.load(state_pth) if os.path.exists(state_pth) else None
+
+    artifacts = load_scoring_artifacts(model_file, quantized)
+    scores, state, stats = delta_score(pd.read_csv(pth), artifacts, state)
+
+    os.makedirs(SCORES_SAVE_FOLDER, exist_ok=True)
+    scores.to_csv(os.path.join(SCORES_SAVE_FOLDER, SCORES_FILE), index=False)
+    joblib.dump(state, state_pth)
+
+    return stats
+
+
+if __name__ == "__main__":
+
+    # extract path from the command line, bank_data.csv by default
+    _pth = sys.argv[1] if len(sys.argv) > 1 else cls.DATA_PTH
+
+    print('Delta scoring ' + _pth)
+    _stats = run_delta_scoring(_pth)
+    print('rescored {rescored} of {rows} rows, skipped {skipped_fraction:.1%}, '
+          'saved {saved_seconds:.3f}s'.format(**_stats))
+    print('Delta scoring Complete')
@@ -8,10 +8,19 @@ Date: 31 May, 2023
 
 import os
 import logging
+import numpy as np
 import pandas as pd
 import joblib
 import pytest
+# HistGradientBoostingClassifier is still experimental in scikit-learn 0.24
+from sklearn.experimental import enable_hist_gradient_boosting  # noqa: F401
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
 import churn_library as cls
+import churn_scoring as scoring
+import churn_rendering as rendering
 
 
 logging.basicConfig(
@@ -174,7 +183,8 @@ def test_encoder_helper(encoder_helper, request):
     # request.config.cache.set('cache_encoded_df', encoded_df.to_json())
 
 
-def test_perform_feature_engineering(perform_feature_engineering, request):
+def test_perform_feature_engineering(
+        perform_feature_engineering, temp_folder, request):
     '''
     test perform_feature_engineering
     '''
@@ -192,10 +202,13 @@ def test_perform_feature_engineering(perform_feature_engineering, request):
             "Testing perform_feature_engineering: cached df is not found")
         raise err_load
 
+    models_save_folder = cls.MODELS_SAVE_FOLDER
     try:
 
         logging.info('Testing perform_feature_engineering: start')
 
+        # the category encodings are saved in the temp folder
+        cls.MODELS_SAVE_FOLDER = os.path.join(temp_folder, '')
         _X_train, _X_test, _y_train, _y_test = perform_feature_engineering(
             df, 'Churn')
 
@@ -207,11 +220,18 @@ def test_perform_feature_engineering(perform_feature_engineering, request):
 
         assert len(_X_train) == len(_y_train)
         assert len(_X_test) == len(_y_test)
+        assert os.path.exists(
+            cls.MODELS_SAVE_FOLDER + cls.CATEGORY_ENCODINGS_FILE)
 
     except AssertionError as err:
         logging.error(
             "Testing perform_feature_engineering: wrong feature engineering")
         raise err
+    finally:
+        encodings_file = cls.MODELS_SAVE_FOLDER + cls.CATEGORY_ENCODINGS_FILE
+        if os.path.exists(encodings_file):
+            os.remove(encodings_file)
+        cls.MODELS_SAVE_FOLDER = models_save_folder
 
     # request push data for train models test
     request.config.cache.set('cache_x_train', _X_train.to_json())
@@ -227,6 +247,430 @@ def test_perform_feature_engineering(perform_feature_engineering, request):
     logging.info("Testing perform_feature_engineering: SUCCESS")
 
 
+def test_hash_split(hash_split, request):
+    '''
+    test the hash split is stable when customers are added
+    '''
+    # load the output of import_data() and check df size to verify
+    try:
+        df = pd.read_json(request.config.cache.get('cache_df', None))
+        assert df.shape[0] > 0
+        logging.info("Testing hash_split: cached df found")
+
+    except Exception as err_load:
+        logging.error("Testing hash_split: cached df is not found")
+        raise err_load
+
+    try:
+        buckets = hash_split(df['CLIENTNUM'], test_size=0.2, validation_size=0.1)
+        assert set(buckets.categories) == {'train', 'test', 'validation'}
+
+        # the hashed ids fill the buckets in the expected fractions
+        fractions = pd.Series(buckets).value_counts(normalize=True)
+        assert abs(fractions['test'] - 0.2) < 0.02
+        assert abs(fractions['validation'] - 0.1) < 0.02
+
+        # the first customers keep their bucket when the rest are added
+        first_buckets = hash_split(
+            df['CLIENTNUM'][:100], test_size=0.2, validation_size=0.1)
+        assert list(first_buckets) == list(buckets[:100])
+
+        # the salt changes the assignment
+        salted_buckets = hash_split(
+            df['CLIENTNUM'], test_size=0.2, validation_size=0.1, salt=1)
+        assert list(salted_buckets) != list(buckets)
+    except AssertionError as err:
+        logging.error("Testing hash_split: unstable or unbalanced split")
+        raise err
+
+    logging.info("Testing hash_split: SUCCESS")
+
+
+def test_apply_bin_edges(apply_bin_edges, request):
+    '''
+    test quantile binning of the feature matrix
+    '''
+    # load the output of perform_feature_engineering()
+    try:
+        x_train = pd.read_json(request.config.cache.get('cache_x_train', None))
+        x_test = pd.read_json(request.config.cache.get('cache_x_test', None))
+        assert x_train.shape[0] > 0
+        logging.info("Testing apply_bin_edges: cached x_train found")
+
+    except Exception as err_load:
+        logging.error("Testing apply_bin_edges: cached x_train is not found")
+        raise err_load
+
+    try:
+        bin_edges = cls.quantile_bin_edges(x_train, n_bins=256)
+        x_train_binned = apply_bin_edges(x_train, bin_edges)
+        x_test_binned = apply_bin_edges(x_test, bin_edges)
+
+        assert x_train_binned.dtype == np.uint8
+        assert x_train_binned.flags['C_CONTIGUOUS']
+        assert x_train_binned.shape == x_train.shape
+        assert x_test_binned.shape == x_test.shape
+
+        # binning keeps the order of the values of every feature
+        for i, column in enumerate(x_train.columns):
+            order = np.argsort(x_train[column].to_numpy(), kind='stable')
+            assert np.all(np.diff(x_train_binned[order, i].astype(int)) >= 0)
+    except AssertionError as err:
+        logging.error("Testing apply_bin_edges: wrong quantized feature matrix")
+        raise err
+
+    logging.info("Testing apply_bin_edges: SUCCESS")
+
+
+def test_fit_model_engine(fit_model_engine, request):
+    '''
+    test fit_model_engine with a small registered engine
+    '''
+    # load the output of perform_feature_engineering()
+    try:
+        x_train = pd.read_json(request.config.cache.get('cache_x_train', None))
+        y_train = pd.read_json(
+            request.config.cache.get('cache_y_train', None),
+            typ='series',
+            orient='records')
+        assert x_train.shape[0] > 0
+        logging.info("Testing fit_model_engine: cached x_train found")
+
+    except Exception as err_load:
+        logging.error("Testing fit_model_engine: cached x_train is not found")
+        raise err_load
+
+    try:
+        cls.register_model_engine(
+            'test_hgb',
+            'Test Histogram Gradient Boosting',
+            lambda: HistGradientBoostingClassifier(max_iter=10),
+            'test_hgb_model.pkl',
+            'test_hgb_results.png',
+            param_grid={'max_leaf_nodes': [7, 15]})
+        model = fit_model_engine('test_hgb', x_train, y_train)
+
+        # grid search returns the tuned estimator
+        assert model.max_leaf_nodes in [7, 15]
+        assert len(model.predict(x_train)) == len(x_train)
+    except AssertionError as err:
+        logging.error("Testing fit_model_engine: engine was not fitted")
+        raise err
+    finally:
+        cls.MODEL_ENGINES.pop('test_hgb', None)
+
+    logging.info("Testing fit_model_engine: SUCCESS")
+
+
+def test_train_segment_models(train_segment_models, temp_folder, request):
+    '''
+    test per Card_Category models and the routing of customers to them
+    '''
+    # load the outputs of import_data() and perform_feature_engineering()
+    try:
+        df = pd.read_json(request.config.cache.get('cache_df', None))
+        x_train = pd.read_json(request.config.cache.get('cache_x_train', None))
+        y_train = pd.read_json(
+            request.config.cache.get('cache_y_train', None),
+            typ='series',
+            orient='records')
+        assert x_train.shape[0] > 0
+        logging.info("Testing train_segment_models: cached data found")
+
+    except Exception as err_load:
+        logging.error("Testing train_segment_models: cached data is not found")
+        raise err_load
+
+    models_save_folder = cls.MODELS_SAVE_FOLDER
+    try:
+        # the segment models are saved in the temp folder
+        cls.MODELS_SAVE_FOLDER = os.path.join(temp_folder, '')
+        cls.register_model_engine(
+            'test_rf',
+            'Test Random Forest',
+            lambda: RandomForestClassifier(
+                n_estimators=10, max_depth=4, random_state=42),
+            'test_rf_model.pkl',
+            'test_rf_results.png')
+        segments = df.loc[x_train.index, 'Card_Category']
+        segment_models = train_segment_models(
+            x_train, y_train, segments, engine='test_rf', n_jobs=2)
+
+        # Blue is the largest segment, Platinum is too small for its own model
+        assert segment_models['segment_column'] == 'Card_Category'
+        assert 'Blue' in segment_models['models']
+        assert 'Platinum' not in segment_models['models']
+        assert os.path.exists(cls.MODELS_SAVE_FOLDER + cls.SEGMENT_MODELS_FILE)
+
+        routes = scoring.model_routes(df, segment_models)
+        assert sum(rows.sum() for rows, _ in routes) == len(df)
+        assert routes[-1][1] is segment_models['global']
+        assert (df['Card_Category'][routes[-1][0]] != 'Blue').all()
+    except AssertionError as err:
+        logging.error("Testing train_segment_models: wrong segment models")
+        raise err
+    finally:
+        cls.MODEL_ENGINES.pop('test_rf', None)
+        segment_models_file = cls.MODELS_SAVE_FOLDER + cls.SEGMENT_MODELS_FILE
+        if os.path.exists(segment_models_file):
+            os.remove(segment_models_file)
+        cls.MODELS_SAVE_FOLDER = models_save_folder
+
+    logging.info("Testing train_segment_models: SUCCESS")
+
+
+def test_compare_logistic_solvers(compare_logistic_solvers, request):
+    '''
+    test the scaled logistic regression converges with every solver
+    '''
+    # load the output of perform_feature_engineering()
+    try:
+        x_train = pd.read_json(request.config.cache.get('cache_x_train', None))
+        x_test = pd.read_json(request.config.cache.get('cache_x_test', None))
+        y_train = pd.read_json(
+            request.config.cache.get('cache_y_train', None),
+            typ='series',
+            orient='records')
+        y_test = pd.read_json(
+            request.config.cache.get('cache_y_test', None),
+            typ='series',
+            orient='records')
+        assert x_train.shape[0] > 0
+        logging.info("Testing compare_logistic_solvers: cached data found")
+
+    except Exception as err_load:
+        logging.error("Testing compare_logistic_solvers: cached data is not found")
+        raise err_load
+
+    try:
+        solvers = compare_logistic_solvers(x_train, x_test, y_train, y_test)
+        logging.info("solvers: \n {}".format(solvers.to_string()))
+
+        assert set(solvers['solver']) == {'lbfgs', 'saga', 'liblinear'}
+        assert solvers['converged'].all()
+        assert (solvers['test_auc'] > 0.5).all()
+    except AssertionError as err:
+        logging.error(
+            "Testing compare_logistic_solvers: scaled logistic regression did not converge")
+        raise err
+
+    logging.info("Testing compare_logistic_solvers: SUCCESS")
+
+
+def test_delta_score(delta_score, request):
+    '''
+    test delta scoring only rescores new and changed customers
+    '''
+    # load the output of import_data() and check df size to verify
+    try:
+        df = pd.read_json(request.config.cache.get('cache_df', None))
+        assert df.shape[0] > 0
+        logging.info("Testing delta_score: cached df found")
+
+    except Exception as err_load:
+        logging.error("Testing delta_score: cached df is not found")
+        raise err_load
+
+    try:
+        artifacts = {
+            'model': None,
+            'encodings': cls.category_encodings(df, scoring.CATEGORY_COLUMNS),
+            'bin_edges': None,
+        }
+        artifacts['model'] = LogisticRegression(max_iter=3000).fit(
+            scoring.build_features(df, artifacts), df['Churn'])
+
+        _, state, stats = delta_score(df, artifacts)
+        assert stats['rescored'] == len(df)
+
+        # delete 3 customers, change 10 and add 2 new ones
+        next_df = df.drop(index=df.index[:3]).copy()
+        next_df.loc[next_df.index[:10], 'Total_Trans_Ct'] += 5
+        new_customers = df.iloc[3:5].copy()
+        new_customers['CLIENTNUM'] = [-1, -2]
+        next_df = pd.concat([next_df, new_customers])
+
+        scores, state, stats = delta_score(next_df, artifacts, state)
+        logging.info('delta_score stats: {}'.format(stats))
+
+        assert stats['new'] == 2
+        assert stats['changed'] == 10
+        assert stats['deleted'] == 3
+        assert stats['rescored'] == 12
+        assert stats['skipped_fraction'] == 1 - 12 / len(next_df)
+        pd.testing.assert_frame_equal(
+            scores, scoring.score_customers(next_df, artifacts))
+
+        # nothing changed since the last run
+        _, _, stats = delta_score(next_df, artifacts, state)
+        assert stats['rescored'] == 0
+
+        # an empty extract scores nothing, with and without a previous run
+        for previous_state in [state, None]:
+            scores, _, stats = delta_score(next_df.iloc[:0], artifacts,
+                                           previous_state)
+            assert len(scores) == 0
+            assert list(scores.columns) == scoring.SCORE_COLUMNS
+            assert stats['rescored'] == 0
+    except AssertionError as err:
+        logging.error("Testing delta_score: wrong delta scores")
+        raise err
+
+    logging.info("Testing delta_score: SUCCESS")
+
+
+def test_explain_customers(explain_customers, request):
+    '''
+    test the fast churn drivers add up to the forest churn probability
+    '''
+    # load the output of perform_feature_engineering()
+    try:
+        x_train = pd.read_json(request.config.cache.get('cache_x_train', None))
+        y_train = pd.read_json(
+            request.config.cache.get('cache_y_train', None),
+            typ='series',
+            orient='records')
+        assert x_train.shape[0] > 0
+        logging.info("Testing explain_customers: cached x_train found")
+
+    except Exception as err_load:
+        logging.error("Testing explain_customers: cached x_train is not found")
+        raise err_load
+
+    try:
+        model = RandomForestClassifier(
+            n_estimators=20, max_depth=5, random_state=42).fit(x_train, y_train)
+
+        contributions = scoring.path_contributions(model, x_train)
+        # the per model tables give the same contributions
+        assert np.allclose(contributions, scoring.path_contributions(
+            model, x_train, scoring.path_sum_tables(model)))
+        bias = np.mean([tree.tree_.value[0, 0, 1] / tree.tree_.value[0, 0].sum()
+                        for tree in model.estimators_])
+        assert np.allclose(contributions.sum(axis=1) + bias,
+                           model.predict_proba(x_train)[:, 1])
+
+        reasons = explain_customers(model, x_train, 'fast', top_k=3, n_jobs=1)
+        assert len(reasons) == len(x_train)
+        assert list(reasons.columns) == [
+            'reason_1', 'reason_1_contribution',
+            'reason_2', 'reason_2_contribution',
+            'reason_3', 'reason_3_contribution']
+        assert set(reasons['reason_1']) <= set(cls.FEATURE_COLUMNS)
+        assert (reasons['reason_1_contribution']
+                >= reasons['reason_2_contribution']).all()
+    except AssertionError as err:
+        logging.error("Testing explain_customers: wrong churn drivers")
+        raise err
+
+    logging.info("Testing explain_customers: SUCCESS")
+
+
+def test_compact_forest(compact_forest, request):
+    '''
+    test the compacted forest predicts like the forest and meets the AUC budget
+    '''
+    # load the output of perform_feature_engineering()
+    try:
+        x_train = pd.read_json(request.config.cache.get('cache_x_train', None))
+        x_test = pd.read_json(request.config.cache.get('cache_x_test', None))
+        y_train = pd.read_json(
+            request.config.cache.get('cache_y_train', None),
+            typ='series',
+            orient='records')
+        assert x_train.shape[0] > 0
+        logging.info("Testing compact_forest: cached data found")
+
+    except Exception as err_load:
+        logging.error("Testing compact_forest: cached data is not found")
+        raise err_load
+
+    try:
+        # the compaction is tuned on validation data held out from training
+        x_fit, x_val, y_fit, y_val = train_test_split(
+            x_train, y_train, test_size=0.2, random_state=42)
+        forest = RandomForestClassifier(
+            n_estimators=50, random_state=42).fit(x_fit, y_fit)
+
+        # without pruning the compact arrays predict exactly like the forest
+        full_model = cls.CompactForest(forest)
+        assert full_model.threshold.dtype == np.float32
+        assert full_model.left.dtype == np.int32
+        assert np.allclose(full_model.predict_proba(x_test),
+                           forest.predict_proba(x_test), atol=1e-6)
+
+        compact_model, summary = compact_forest(
+            forest, x_val, y_val, auc_budget=0.01)
+        logging.info('compact_forest summary: {}'.format(summary))
+        assert summary['trees'] <= 50
+        assert summary['nodes'] <= len(full_model.left)
+        assert summary['compact_auc'] >= summary['full_auc'] - 0.01
+        assert set(compact_model.predict(x_test)) <= set(forest.classes_)
+    except AssertionError as err:
+        logging.error("Testing compact_forest: wrong compacted forest")
+        raise err
+
+    logging.info("Testing compact_forest: SUCCESS")
+
+
+def test_render_results(render_results, temp_folder, request):
+    '''
+    test result images render concurrently and the text mode writes reports
+    '''
+    # load the output of perform_feature_engineering()
+    try:
+        x_train = pd.read_json(request.config.cache.get('cache_x_train', None))
+        x_test = pd.read_json(request.config.cache.get('cache_x_test', None))
+        y_train = pd.read_json(
+            request.config.cache.get('cache_y_train', None),
+            typ='series',
+            orient='records')
+        y_test = pd.read_json(
+            request.config.cache.get('cache_y_test', None),
+            typ='series',
+            orient='records')
+        assert x_train.shape[0] > 0
+        logging.info("Testing render_results: cached data found")
+
+    except Exception as err_load:
+        logging.error("Testing render_results: cached data is not found")
+        raise err_load
+
+    try:
+        model = RandomForestClassifier(
+            n_estimators=10, max_depth=4, random_state=42).fit(x_train, y_train)
+        metrics = {
+            'models': [rendering.model_metrics(
+                'Random Forest', 'rf_results.png',
+                model, x_train, x_test, y_train, y_test)],
+            'importance': rendering.importance_metrics(
+                model, x_train, x_train.columns),
+        }
+
+        image_files = render_results(metrics, temp_folder, executor='thread')
+        text_files = rendering.write_results_text(metrics, temp_folder)
+
+        expected_files = [
+            'rf_results.png',
+            'roc_curve_result.png',
+            'feature_importance.png',
+            'feature_impact.png',
+            'rf_results.txt',
+            'results.json']
+        generated_files = [os.path.basename(path)
+                           for path in image_files + text_files]
+        assert sorted(generated_files) == sorted(expected_files)
+        assert set(expected_files) <= set(os.listdir(temp_folder))
+    except AssertionError as err:
+        logging.error("Testing render_results: result files missing")
+        raise err
+    finally:
+        for file_name in os.listdir(temp_folder):
+            os.remove(os.path.join(temp_folder, file_name))
+
+    logging.info("Testing render_results: SUCCESS")
+
+
 @pytest.mark.skip(reason="model training takes a long time. Not worth testing every time.")
 def test_train_models(train_models, request):
     '''
@@ -291,8 +735,8 @@ def test_train_models(train_models, request):
         raise err_train
 
     try:
-        joblib.load("models/rfc_model.pkl")
-        joblib.load("models/logistic_model.pkl")
+        for engine in cls.DEFAULT_ENGINES:
+            joblib.load("models/" + cls.MODEL_ENGINES[engine]['model_file'])
         logging.info("Testing testing_models: SUCCESS")
     except FileNotFoundError as err:
         logging.error(
@@ -9,6 +9,8 @@ import os
 import logging
 import pytest
 import churn_library as cls
+import churn_scoring as scoring
+import churn_rendering as rendering
 
 
 @pytest.fixture
@@ -36,6 +38,51 @@ def train_models():
     return cls.train_models
 
 
+@pytest.fixture
+def hash_split():
+    return cls.hash_split
+
+
+@pytest.fixture
+def fit_model_engine():
+    return cls.fit_model_engine
+
+
+@pytest.fixture
+def train_segment_models():
+    return cls.train_segment_models
+
+
+@pytest.fixture
+def compare_logistic_solvers():
+    return cls.compare_logistic_solvers
+
+
+@pytest.fixture
+def apply_bin_edges():
+    return cls.apply_bin_edges
+
+
+@pytest.fixture
+def delta_score():
+    return scoring.delta_score
+
+
+@pytest.fixture
+def explain_customers():
+    return scoring.explain_customers
+
+
+@pytest.fixture
+def render_results():
+    return rendering.render_results
+
+
+@pytest.fixture
+def compact_forest():
+    return cls.compact_forest
+
+
 @pytest.fixture
 def eda_outputs():
     gen_files = [